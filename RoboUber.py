@@ -171,7 +171,7 @@ def runRoboUber(worldX, worldY, runTime, stop, junctions=None, streets=None, int
 
     # and a dispatcher
     print("Adding a dispatcher")
-    dispatcher0 = dispatcher.Dispatcher(parent=svcArea, taxis=taxis)
+    dispatcher0 = dispatcher.Dispatcher(parent=svcArea, taxis=taxis, verbose=True)
 
     # who should be on duty
     svcArea.addDispatcher(dispatcher0)
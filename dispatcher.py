@@ -1,11 +1,15 @@
+import sys
 import math
 import numpy
 import heapq
+import bisect
 
 
 # a data container for all pertinent information related to fares. (Should we
 # add an underway flag and require taxis to acknowledge collection to the dispatcher?)
 class FareEntry:
+    # one FareEntry is made for every fare that calls, so keep them small and quick to access
+    __slots__ = ('origin', 'destination', 'calltime', 'price', 'taxi', 'bidders')
 
     def __init__(self, origin, dest, time, price=0, taxiIndex=-1):
         self.origin = origin
@@ -18,6 +22,22 @@ class FareEntry:
         self.bidders = []
 
 
+# the price of a fare given its travel time from origin to destination. Since travel time already puts traffic
+# into consideration, the price automatically includes traffic.
+def _fareCost(timeToDestination):
+    # This variable indicates the maximum allowed cost before the fare is abandoned
+    maximumCostAllowed = 10 * timeToDestination
+
+    # It will only return the default 150 and abandon the fare if timeToDestination <= 0
+    if timeToDestination <= 0:
+        return 150
+    # Cost samples are timeToDestination / 0.9 plus a whole number of steps, up to 199 of them. The highest
+    # cost possible for maximum revenue is the first sample that reaches maximumCostAllowed - 1, which can be
+    # worked out directly rather than by stepping through the samples one by one.
+    baseCost = timeToDestination / 0.9
+    return baseCost + min(math.ceil(maximumCostAllowed - 1 - baseCost), 199)
+
+
 '''
 A Dispatcher is a static agent whose job is to allocate fares amongst available taxis. Like the taxis, all
 the relevant functionality happens in ClockTick. The Dispatcher has a list of taxis, a map of the service area,
@@ -29,10 +49,14 @@ now have the fare.
 
 
 class Dispatcher:
+    # how many unknown travel times to a single destination it takes before the world is asked for them
+    # all at once with travelTimeBatch rather than one at a time. Below about 32 the batch is slower.
+    TRAVEL_TIME_BATCH_SIZE = 32
 
     # constructor only needs to know the world it lives in, although you can also populate its knowledge base
-    # with taxi and map information.
-    def __init__(self, parent, taxis=None, serviceMap=None):
+    # with taxi and map information. Revenues are only printed if verbose is set, and then only every
+    # displayInterval ticks.
+    def __init__(self, parent, taxis=None, serviceMap=None, verbose=False, displayInterval=100):
 
         self._parent = parent
         # our incoming account
@@ -41,20 +65,36 @@ class Dispatcher:
         self._taxis = taxis
         if self._taxis is None:
             self._taxis = []
-        # fareBoard will be a nested dictionary indexed by origin, then destination, then call time.
-        # Its values are FareEntries. The nesting structure provides for reasonably fast lookup; it's
-        # more or less a multi-level hash.
+        # reverse index from each taxi to its position in _taxis, so bids don't have to search the list
+        self._taxiIndex = {taxi: i for i, taxi in enumerate(self._taxis)}
+        # fareBoard is a flat dictionary indexed by (origin, destination, call time) triplets. Its values
+        # are FareEntries. A single hash gets straight to any fare.
         self._fareBoard = {}
+        # faresByOrigin indexes the fareBoard by origin. Each origin has a list of (call time, destination)
+        # pairs kept in call-time order, so fares at a given origin can be visited oldest first without sorting.
+        self._faresByOrigin = {}
         # serviceMap gives the dispatcher its service area
         self._map = serviceMap
         self.fareAmountConstraint = {}
+        # revenue reporting settings, and the number of clock ticks seen so far
+        self._verbose = verbose
+        self._displayInterval = displayInterval
+        self._tickCount = 0
+        # travel times between (origin, destination) coordinate pairs, memoised for the current tick only,
+        # since traffic (and therefore travel time) changes from one tick to the next
+        self._ttCache = {}
+        # world nodes memoised by their (x, y) coordinates
+        self._nodeCache = {}
+        # taxis with a planned path, indexed by where that path ends. Rebuilt at the start of every tick.
+        self._pathDestIndex = {}
 
     # _________________________________________________________________________________________________________
     # methods to add objects to the Dispatcher's knowledge base
 
     # make a new taxi known.
     def addTaxi(self, taxi):
-        if taxi not in self._taxis:
+        if taxi not in self._taxiIndex:
+            self._taxiIndex[taxi] = len(self._taxis)
             self._taxis.append(taxi)
 
     # incrementally add to the map. This can be useful if, e.g. the world itself has a set of
@@ -63,14 +103,14 @@ class Dispatcher:
     def addMapNode(self, coords, neighbours):
         if self._parent is None:
             return AttributeError("This Dispatcher does not exist in any world")
-        node = self._parent.getNode(coords[0], coords[1])
+        node = self._getNode(coords)
         if node is None:
             return KeyError("No such node: {0} in this Dispatcher's service area".format(coords))
         # build up the neighbour dictionary incrementally so we can check for invalid nodes.
         neighbourDict = {}
         for neighbour in neighbours:
             neighbourCoords = (neighbour[1], neighbour[2])
-            neighbourNode = self._parent.getNode(neighbour[1], neighbour[2])
+            neighbourNode = self._getNode(neighbourCoords)
             if neighbourNode is None:
                 return KeyError(
                     "Node {0} expects neighbour {1} which is not in this Dispatcher's service area".format(coords,
@@ -97,12 +137,12 @@ class Dispatcher:
         if self._parent == parent:
             # handover implies taxis definitely known to a previous dispatcher. The current
             # dispatcher should thus be made aware of them
-            if taxi not in self._taxis:
-                self._taxis.append(taxi)
+            self.addTaxi(taxi)
             # add any fares found along with their allocations
             self.newFare(parent, origin, destination, time)
-            self._fareBoard[origin][destination][time].taxi = self._taxis.index(taxi)
-            self._fareBoard[origin][destination][time].price = price
+            fare = self._fareBoard[(origin, destination, time)]
+            fare.taxi = self._taxiIndex[taxi]
+            fare.price = price
 
     # --------------------------------------------------------------------------------------------------------------
     # runtime methods used to inform the Dispatcher of real-time events
@@ -112,46 +152,39 @@ class Dispatcher:
         # only add new fares coming from the same world
         if parent == self._parent:
             fare = FareEntry(origin, destination, time)
-            if origin in self._fareBoard:
-                if destination not in self._fareBoard[origin]:
-                    self._fareBoard[origin][destination] = {}
-            else:
-                self._fareBoard[origin] = {destination: {}}
+            if (origin, destination, time) not in self._fareBoard:
+                bisect.insort(self._faresByOrigin.setdefault(origin, []), (time, destination))
             # overwrites any existing fare with the same (origin, destination, calltime) triplet, but
             # this would be equivalent to saying it was the same fare, at least in this world where
             # a given Node only has one fare at a time.
-            self._fareBoard[origin][destination][time] = fare
+            self._fareBoard[(origin, destination, time)] = fare
 
     # abandoning fares will call this to cancel their request
     def cancelFare(self, parent, origin, destination, calltime):
         # if the fare exists in our world,
-        if parent == self._parent and origin in self._fareBoard:
-            if destination in self._fareBoard[origin]:
-                if calltime in self._fareBoard[origin][destination]:
-                    # get rid of it
-                    print("Fare ({0},{1}) cancelled".format(origin[0], origin[1]))
-                    # inform taxis that the fare abandoned
-                    self._parent.cancelFare(origin, self._taxis[self._fareBoard[origin][destination][calltime].taxi])
-                    del self._fareBoard[origin][destination][calltime]
-                if len(self._fareBoard[origin][destination]) == 0:
-                    del self._fareBoard[origin][destination]
-                if len(self._fareBoard[origin]) == 0:
-                    del self._fareBoard[origin]
+        if parent == self._parent and (origin, destination, calltime) in self._fareBoard:
+            # get rid of it
+            print("Fare ({0},{1}) cancelled".format(origin[0], origin[1]))
+            # inform taxis that the fare abandoned
+            self._parent.cancelFare(origin, self._taxis[self._fareBoard[(origin, destination, calltime)].taxi])
+            del self._fareBoard[(origin, destination, calltime)]
+            self._faresByOrigin[origin].remove((calltime, destination))
+            if len(self._faresByOrigin[origin]) == 0:
+                del self._faresByOrigin[origin]
 
     # taxis register their bids for a fare using this mechanism
     def fareBid(self, origin, taxi):
         # rogue taxis (not known to the dispatcher) can't bid on fares
-        if taxi in self._taxis:
+        if taxi in self._taxiIndex:
             # everyone else bids on fares available
-            if origin in self._fareBoard:
-                for destination in self._fareBoard[origin].keys():
-                    for time in self._fareBoard[origin][destination].keys():
-                        # as long as they haven't already been allocated
-                        if self._fareBoard[origin][destination][time].taxi == -1:
-                            self._fareBoard[origin][destination][time].bidders.append(self._taxis.index(taxi))
-                            # only one fare per origin can be actively open for bid, so
-                            # immediately return once we[ve found it
-                            return
+            for time, destination in self._faresByOrigin.get(origin, ()):
+                fare = self._fareBoard[(origin, destination, time)]
+                # as long as they haven't already been allocated
+                if fare.taxi == -1:
+                    fare.bidders.append(self._taxiIndex[taxi])
+                    # only one fare per origin can be actively open for bid, so
+                    # immediately return once we[ve found it
+                    return
 
     # fares call this (through the parent world) when they have reached their destination
     def recvPayment(self, parent, amount):
@@ -165,136 +198,118 @@ class Dispatcher:
     # 2 main functions the dispatcher needs to run in the world: broadcastFare(origin, destination, price) and
     # allocateFare(origin, taxi).
     def clockTick(self, parent):
-        self.displayRevenues()
+        self._tickCount += 1
+        if self._verbose and self._tickCount % self._displayInterval == 0:
+            self.displayRevenues()
         if self._parent == parent:
-            for origin in self._fareBoard.keys():
-                for destination in self._fareBoard[origin].keys():
-                    # TODO - if you can come up with something better. Not essential though.
-                    # not super-efficient here: need times in order, dictionary view objects are not
-                    # sortable because they are an iterator, so we need to turn the times into a
-                    # sorted list. Hopefully fareBoard will never be too big
-                    for time in sorted(list(self._fareBoard[origin][destination].keys())):
-                        if self._fareBoard[origin][destination][time].price == 0:
-                            self._fareBoard[origin][destination][time].price = self._costFare(
-                                self._fareBoard[origin][destination][time])
-                            # broadcastFare actually returns the number of taxis that got the info, if you
-                            # wish to use that information in the decision over when to allocate
-                            self._parent.broadcastFare(origin,
-                                                       destination,
-                                                       self._fareBoard[origin][destination][time].price)
-                        elif self._fareBoard[origin][destination][time].taxi < 0 and len(
-                                self._fareBoard[origin][destination][time].bidders) > 0:
-                            self._allocateFare(origin, destination, time)
+            self._ttCache.clear()
+            # nothing else to do until some fares call in
+            if not self._fareBoard:
+                return
+            self._pathDestIndex = {}
+            for taxi in self._taxis:
+                if taxi._path:
+                    self._pathDestIndex.setdefault(taxi._path[-1], []).append(taxi)
+            # faresByOrigin already holds each origin's fares in call-time order, so no sorting is needed
+            for origin, fares in self._faresByOrigin.items():
+                for time, destination in fares:
+                    fare = self._fareBoard[(origin, destination, time)]
+                    if fare.price == 0:
+                        fare.price = self._costFare(fare)
+                        # broadcastFare actually returns the number of taxis that got the info, if you
+                        # wish to use that information in the decision over when to allocate
+                        self._parent.broadcastFare(origin, destination, fare.price)
+                    elif fare.taxi < 0 and len(fare.bidders) > 0:
+                        self._allocateFare(origin, destination, time)
 
     # ----------------------------------------------------------------------------------------------------------------
     def _costFare(self, fare):
-        # Since travel time already puts traffic into consideration, when I create cost samples they are
-        # automatically include traffic prices.
-        timeToDestination = self._parent.travelTime(self._parent.getNode(fare.origin[0], fare.origin[1]),
-                                                    self._parent.getNode(fare.destination[0], fare.destination[1]))
-        # This variable indicates the maximum allowed cost before the fare is abandoned
-        maximumCostAllowed = 10 * timeToDestination
-
-        # This function creates cost samples all the way to 200 (if it gets there). Checks the maximum value
-        # against the maximum allowed and chooses the highest cost possible for maximum revenue
-        costSample = None
-        if timeToDestination > 0:
-            for i in range(200):
-                # If each iteration is less than the maximum allowed, adds it to the cost samples
-                if (i + timeToDestination / 0.9) < maximumCostAllowed - 1:
-                    costSample = i + timeToDestination / 0.9
-                else:
-                    # If it's above the maximum allowed, it adds 1 by one until it reaches the maximum.
-                    # This ensures the cost is as optimized as possible.
-                    # This else is not extremely needed because it usually only runs once since it's already
-                    # close to the maximum, but I wanted to optimize it.
-                    while costSample < maximumCostAllowed - 1:
-                        costSample += 1
-                    break
-        # If cost samples isn't empty(timeToDestination > 0), takes the maximum value.
-        # It will only return the default 150 and abandon the fare if timeToDestination <= 0
-        if costSample is not None and costSample > 0:
-            return costSample
-        else:
-            return 150
+        # the fare is priced on how long it currently takes to get from its origin to its destination
+        return _fareCost(self._travelTime(fare.origin, fare.destination))
 
     # ----------------------------------------------------------------------------------------------------------------
     def _allocateFare(self, origin, destination, time):
-        bidders = self._fareBoard[origin][destination][time].bidders
-        fareNode = self._parent.getNode(origin[0], origin[1])
-        # initial dictionary for the first 4 fares
-        initialFares = {}
-        # dictionary that holds th fares once every taxi has taken a fare
-        constraintFares = {}
+        fare = self._fareBoard[(origin, destination, time)]
+        bidders = fare.bidders
+        fareNode = self._getNode(origin)
+        # the coordinates travel times to the fare are measured against. This becomes None once a taxi is
+        # found to be stuck, so that every bidder's travel time to the fare is then 0.
+        fareLoc = origin
+        # (travel time, taxi) of the closest bidder that hasn't taken a fare yet; used for the first 4 fares
+        closestInitial = (math.inf, -1)
+        # (travel time, taxi) of the closest bidder once every taxi has taken a fare
+        closestConstraint = (math.inf, -1)
+        # the bidders who have already taken a fare, in bidding order
+        constraintBidders = []
         allocatedTaxi = -1
 
         if len(self._taxis) > 0 and len(self._fareBoard) > 0:
             if fareNode is not None:
+                # each bidder's location is looked up once, and used for every check below
+                bidderLocs = {taxi: self._taxis[taxi].currentLocation for taxi in bidders}
+                # with plenty of bidders, get all their travel times to the fare and its destination in one go
+                self._prefetchTravelTimes(bidderLocs.values(), origin)
+                self._prefetchTravelTimes(bidderLocs.values(), destination)
 
                 # attempt to stop taxis from getting stuck
                 for taxi in bidders:
-                    bidderNode = self._parent.getNode(self._taxis[taxi].currentLocation[0],
-                                                      self._taxis[taxi].currentLocation[1])
-                    travelToOrigin = self._parent.travelTime(bidderNode, fareNode)
-                    travelToDestination = self._parent.travelTime(bidderNode,
-                                                                  self._parent.getNode(destination[0], destination[1]))
-                    for t in self._taxis:
-                        if len(t._path) > 0 and len(t._path) == travelToOrigin and origin == t._path[-1]:
-                            fareNode = None
-                        if len(t._path) > 0 and len(t._path) == (
-                                travelToOrigin + travelToDestination) and destination == t._path[-1]:
-                            fareNode = None
+                    bidderLoc = bidderLocs[taxi]
+                    travelToOrigin = self._travelTime(bidderLoc, fareLoc)
+                    travelToDestination = self._travelTime(bidderLoc, destination)
+                    # only taxis whose paths end at the fare's origin or destination need checking
+                    for t in self._pathDestIndex.get(origin, ()):
+                        if len(t._path) == travelToOrigin:
+                            fareLoc = None
+                    for t in self._pathDestIndex.get(destination, ()):
+                        if len(t._path) == travelToOrigin + travelToDestination:
+                            fareLoc = None
 
                 # if there is more than one bidder, we perform certain checks to fairly decide who to allocate the
                 # fare to
                 if len(bidders) > 1:
-                    # start by taking all travel distances and putting them into dictionaries
+                    # start by taking all travel distances, keeping track of the closest taxi in each group as we go
                     for i in bidders:
-                        bidderNode = self._parent.getNode(self._taxis[i].currentLocation[0],
-                                                          self._taxis[i].currentLocation[1])
-                        # if the taxi is already in the fare amount constraint dict, add it to constraintFares dict
-                        # otherwise it means the taxi hasn't taken a fare which means, add it to initialFares dict
+                        travelTime = self._travelTime(bidderLocs[i], fareLoc)
+                        # if the taxi is already in the fare amount constraint dict, it competes as a constraint
+                        # bidder, otherwise it means the taxi hasn't taken a fare which means it's an initial bidder
                         if i in self.fareAmountConstraint:
-                            constraintFares[i] = self._parent.travelTime(bidderNode, fareNode)
-                        else:
-                            initialFares[i] = self._parent.travelTime(bidderNode, fareNode)
+                            constraintBidders.append(i)
+                            if travelTime < closestConstraint[0]:
+                                closestConstraint = (travelTime, i)
+                        elif travelTime < closestInitial[0]:
+                            closestInitial = (travelTime, i)
 
                     # if there are still taxis who haven't taken a bid, give it to the taxi with the lowest travel
                     # distance. This is only used for the first fare of each taxi
-                    if initialFares:
-                        allocatedTaxi = min(initialFares, key=initialFares.get)
+                    if closestInitial[1] >= 0:
+                        allocatedTaxi = closestInitial[1]
                     else:
                         # minFareAmount will get the lowest fare count of all the taxis in the constraint
                         # lowestFares will simply check for duplicate taxis with the same low value (minFareAmount)
                         # validBidders will compare the lowestFares taxis and make sure they correspond to any
-                        # of the bidders in the constraintFares.
+                        # of the constraint bidders.
                         minFareAmount = min(self.fareAmountConstraint.values())
-                        lowestFares = [i for i, j in self.fareAmountConstraint.items() if
-                                       j == minFareAmount]
-                        validBidders = [x for x in constraintFares if x in lowestFares]
+                        lowestFares = {i for i, j in self.fareAmountConstraint.items() if
+                                       j == minFareAmount}
+                        validBidders = [x for x in constraintBidders if x in lowestFares]
                         # if there is more than one valid taxi, we choose the one with the shortest travel time
                         if len(validBidders) > 1:
-                            travelTimes = {}
-                            for i in validBidders:
-                                bidderNode = self._parent.getNode(self._taxis[i].currentLocation[0],
-                                                                  self._taxis[i].currentLocation[1])
-                                travelTimes[i] = self._parent.travelTime(bidderNode, fareNode)
-                            allocatedTaxi = min(travelTimes, key=travelTimes.get)
+                            allocatedTaxi = self._closestBidder(validBidders, bidderLocs, fareLoc)
                         else:
                             # if there is only one, we choose that taxi.
                             if len(validBidders) > 0:
                                 allocatedTaxi = validBidders[0]
                             else:
                                 # If there is no valid bidders, we take the taxi with the lowest fare amount from
-                                # the constraintFares bidders.
-                                allocatedTaxi = min(constraintFares, key=constraintFares.get)
+                                # the constraint bidders.
+                                allocatedTaxi = closestConstraint[1]
                 else:
                     # if there is only one bidder at all, give him the fare
                     allocatedTaxi = bidders[0]
 
                 # once all the constraints are checked and a decision is made, allocate a fare to the taxi
                 if allocatedTaxi >= 0:
-                    self._fareBoard[origin][destination][time].taxi = allocatedTaxi
+                    fare.taxi = allocatedTaxi
                     self._parent.allocateFare(origin, self._taxis[allocatedTaxi])
                     # updates the fare amount constraint counters every time a taxi takes a new fare.
                     # This will keep track of how many fares taxis have taken
@@ -303,12 +318,59 @@ class Dispatcher:
                     else:
                         self.fareAmountConstraint[allocatedTaxi] = 1
 
-    # function that simply prints all revenues
+    # ----------------------------------------------------------------------------------------------------------------
+    # looks up the world node at the given (x, y) coordinates, remembering it for next time. None coordinates
+    # give a None node, i.e. 'The Void'. Coordinates with no node aren't remembered, since the world may
+    # gain a node there later.
+    def _getNode(self, coords):
+        if coords is None:
+            return None
+        node = self._nodeCache.get(coords)
+        if node is None:
+            node = self._parent.getNode(coords[0], coords[1])
+            if node is not None:
+                self._nodeCache[coords] = node
+        return node
+
+    # travel time between the nodes at 2 coordinates. The world is only asked once per tick for any
+    # given (origin, destination) pair; after that the answer comes from _ttCache.
+    def _travelTime(self, origin, destination):
+        key = (origin, destination)
+        travelTime = self._ttCache.get(key)
+        if travelTime is None:
+            travelTime = self._parent.travelTime(self._getNode(origin), self._getNode(destination))
+            self._ttCache[key] = travelTime
+        return travelTime
+
+    # the bidder with the shortest travel time to fareLoc, taking the earliest bidder in the event of a tie
+    def _closestBidder(self, bidders, bidderLocs, fareLoc):
+        closest = (math.inf, -1)
+        for i in bidders:
+            travelTime = self._travelTime(bidderLocs[i], fareLoc)
+            if travelTime < closest[0]:
+                closest = (travelTime, i)
+        return closest[1]
+
+    # works out the travel times from several locations to a single destination with one batched query to the
+    # world, leaving them in _ttCache for _travelTime to pick up. Only done once there are enough of them to
+    # make the batch worthwhile.
+    def _prefetchTravelTimes(self, origins, destination):
+        # too few locations for a batch to pay off, so leave them all to _travelTime
+        if len(origins) < self.TRAVEL_TIME_BATCH_SIZE:
+            return
+        missing = [origin for origin in dict.fromkeys(origins) if (origin, destination) not in self._ttCache]
+        if len(missing) >= self.TRAVEL_TIME_BATCH_SIZE:
+            travelTimes = self._parent.travelTimeBatch([self._getNode(origin) for origin in missing],
+                                                       self._getNode(destination))
+            for origin, travelTime in zip(missing, travelTimes):
+                self._ttCache[(origin, destination)] = int(travelTime)
+
+    # function that simply prints all revenues, in a single write
     def displayRevenues(self):
-        totalRevenue = 0
-        print(f"Current dispater revenue: {self._revenue}")
-        totalRevenue += self._revenue
+        totalRevenue = self._revenue
+        lines = [f"Current dispater revenue: {self._revenue}"]
         for taxi in self._taxis:
-            print(f"Taxi {taxi.number} current revenue: {taxi._revenue}")
+            lines.append(f"Taxi {taxi.number} current revenue: {taxi._revenue}")
             totalRevenue += taxi._revenue
-        print(f"Total overall revenue is {totalRevenue}")
+        lines.append(f"Total overall revenue is {totalRevenue}")
+        sys.stdout.write("\n".join(lines) + "\n")